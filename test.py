@@ -1,8 +1,19 @@
 import pygame
 import pymunk
-import pymunk.pygame_util
-import random
+import math
+import numpy as np
+import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from collections import defaultdict
+from collections.abc import Mapping
+from operator import attrgetter
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
 
 CATEGORY_1 = 0b001
 CATEGORY_2 = 0b010
@@ -27,49 +38,60 @@ support = pymunk.ShapeFilter(
     mask=CATEGORY_1                  # Can collide with type 1 only
 )
 
+_space_pool = [] # (space, ball_body) returned by Bridge.dispose, spaces hold only the ball and use the default broadphase
+
 class Bridge:
-    def __init__(self, nodes, static_nodes, edges):
+    def __init__(self, nodes, static_nodes, edges, solver_iterations=25):
         """
         nodes: dict - {node_id: (x, y)} coordinates of nodes
         edges: list - {(a_node_id, b_node_id): mass} edges by node ids with mass
         static_nodes: list or set - node ids that are static with respect to world
+        solver_iterations: int - iterations of the space's constraint solver per step
         """
-        self.space = pymunk.Space()
+        # a pooled space keeps its ball, a new one gets it from place_ball
+        self.space, self.ball_body = _space_pool.pop() if _space_pool else (pymunk.Space(), None)
         self.space.gravity = (0, 900)
         self.space.damping = 0.5
-        self.space.iterations = 500
+        self.space.iterations = solver_iterations
 
         self.nodes = nodes
-        self.static_nodes = static_nodes
+        self.static_nodes = frozenset(static_nodes)
         self.edges = edges
 
-        self.adj = {} # a_node_id: [b_node_id, ...]
+        self.adj = defaultdict(list) # a_node_id: [b_node_id, ...]
         self.seg_bodies = {} # (a_node_id, b_node_id): body
+        self.shapes = [] # segment shapes, one per edge
         self.joints = []
+        self.spatial_hash = False
 
-        for (a, b), (mass, is_road) in self.edges.items():
-            if a > b:
-                a, b = b, a
+        # edges keyed with the smaller node id first
+        canon = [((a, b) if a < b else (b, a), v) for (a, b), v in self.edges.items()]
 
-            if a not in self.adj.keys():
-                self.adj[a] = []
-            if b not in self.adj.keys():
-                self.adj[b] = []
+        for (a, b), (mass, is_road) in canon:
             self.adj[a].append(b)
             self.adj[b].append(a)
 
             a_pos = self.nodes[a]
             b_pos = self.nodes[b]
 
+            mx = 0.5 * (a_pos[0] + b_pos[0])
+            my = 0.5 * (a_pos[1] + b_pos[1])
+
             body = pymunk.Body()
-            body.position = (a_pos + b_pos) / 2
+            body.position = (mx, my)
             self.space.add(body)
             self.seg_bodies[a, b] = body
 
-            segment = pymunk.Segment(body, a_pos - body.position, b_pos - body.position, radius=5)
+            segment = pymunk.Segment(body, (a_pos[0] - mx, a_pos[1] - my), (b_pos[0] - mx, b_pos[1] - my), radius=5)
             segment.mass = mass
             segment.filter = road if is_road else support
             self.space.add(segment)
+            self.shapes.append(segment)
+
+        seg_bodies = self.seg_bodies
+        joints_append = self.joints.append
+        space_add = self.space.add
+        PivotJoint = pymunk.PivotJoint
 
         for a, nbhs in self.adj.items():
             a_pos = self.nodes[a]
@@ -86,33 +108,60 @@ class Bridge:
                     if a2 > c:
                         a2, c = c, a2
 
-                    b_body = self.seg_bodies[a1, b]
-                    c_body = self.seg_bodies[a2, c]
+                    b_body = seg_bodies[a1, b]
+                    c_body = seg_bodies[a2, c]
 
-                    joint = pymunk.PivotJoint(b_body, c_body, a_pos)
+                    joint = PivotJoint(b_body, c_body, a_pos)
                     joint.collide_bodies = False
-                    self.space.add(joint)
-                    self.joints.append(joint)
-
-        for a, b in self.edges:
-            if a in self.static_nodes:
-                stat = a
-            elif b in self.static_nodes:
-                stat = b
-            else:
-                continue
+                    space_add(joint)
+                    joints_append(joint)
 
-            if a > b:
-                a, b = b, a
+        static_nodes = self.static_nodes
+        static_edges = [
+            ((a, b), a if a in static_nodes else b)
+            for (a, b), _ in canon
+            if a in static_nodes or b in static_nodes
+        ] # ((a_node_id, b_node_id), static_node_id)
 
+        for (a, b), stat in static_edges:
             body = pymunk.Body(body_type=pymunk.Body.STATIC)
             body.position = self.nodes[stat]
-            self.space.add(body)
+            space_add(body)
 
-            joint = pymunk.PivotJoint(body, self.seg_bodies[a, b], body.position)
+            joint = PivotJoint(body, seg_bodies[a, b], body.position)
             joint.collide_bodies = False
-            self.space.add(joint)
-            self.joints.append(joint)
+            space_add(joint)
+            joints_append(joint)
+
+        # larger bridges: pre-sized spatial hash instead of the default bounding box tree
+        if len(self.shapes) > 30:
+            self.space.use_spatial_hash(40.0, len(self.shapes) * 4)
+            self.spatial_hash = True
+
+    def dispose(self):
+        """Empty the space but keep its ball and return both to the pool, the bridge can't be simulated afterwards"""
+        space = self.space
+        if space is None:
+            return
+
+        ball_body = self.ball_body
+        space.remove(
+            *space.constraints,
+            *[shape for shape in space.shapes if shape.body is not ball_body],
+            *[body for body in space.bodies if body is not ball_body],
+        )
+        # a space can't go back to the bounding box tree, keep hashed ones out of the pool
+        if not self.spatial_hash:
+            _space_pool.append((space, ball_body))
+        self.space = None
+        self.ball_body = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.dispose()
+        return False
 
 def mutate(bridge):
     nodes = bridge.nodes
@@ -120,24 +169,88 @@ def mutate(bridge):
 
     return Bridge(nodes, bridge.static_nodes, edges)
 
-def cross_nodes(a_nodes, b_nodes, a_static_nodes):
-    nodes = {}
-    for n, pos1 in a_nodes.items():
-        if n in a_static_nodes or random.random() > 0.5: # prob of gene cross
-            nodes[n] = pos1
-            continue
+if njit is not None:
+    @njit(parallel=True, fastmath=True)
+    def _cross_nodes_kernel(A, B, choose_b, out):
+        """out[i] = index of the row of B nearest to A[i], or -1 where choose_b[i] is False or B is empty"""
+        for i in prange(A.shape[0]):
+            if not choose_b[i] or B.shape[0] == 0:
+                out[i] = -1
+                continue
+
+            # seeded from B[0], fastmath assumes no infinities
+            dx = B[0, 0] - A[i, 0]
+            dy = B[0, 1] - A[i, 1]
+            best = 0
+            best_d2 = dx * dx + dy * dy
+            for j in range(1, B.shape[0]):
+                dx = B[j, 0] - A[i, 0]
+                dy = B[j, 1] - A[i, 1]
+                d2 = dx * dx + dy * dy
+                if d2 < best_d2:
+                    best_d2 = d2
+                    best = j
+            out[i] = best
+else:
+    _cross_nodes_kernel = None
+
+class NodeView(Mapping):
+    """Read-only {node_id: (x, y)} mapping over an (N, 2) array of positions"""
+    def __init__(self, index, pos):
+        """
+        index: dict - {node_id: row} shared by every view of the same node set
+        pos: np.ndarray - (N, 2) node coordinates
+        """
+        self.index = index
+        self.pos = pos
 
-        min_dist = float('inf')
-        close_pos2 = None
-        for pos2 in b_nodes.values():
-            dist = (pos2 - pos1).length
-            if dist < min_dist:
-                close_pos2 = pos2
-                min_dist = dist
+    def __getitem__(self, n):
+        x, y = self.pos[self.index[n]]
+        return (float(x), float(y))
 
-        nodes[n] = close_pos2
+    def __iter__(self):
+        return iter(self.index)
 
-    return nodes
+    def __len__(self):
+        return len(self.index)
+
+def _as_node_array(nodes):
+    if isinstance(nodes, NodeView):
+        return nodes.index, nodes.pos
+
+    index = {n: i for i, n in enumerate(nodes)}
+    return index, np.array(list(nodes.values()), dtype=np.float64).reshape(-1, 2)
+
+def cross_nodes(a_nodes, b_nodes, a_static_nodes, rng=None):
+    """
+    rng: np.random.Generator - source of the crossover draws, a fresh unseeded one if None
+    returns: NodeView - child positions sharing a_nodes' node index
+    """
+    a_index, A = _as_node_array(a_nodes)
+    _, B = _as_node_array(b_nodes)
+
+    static_mask = np.array([n in a_static_nodes for n in a_index], dtype=bool)
+    if rng is None:
+        rng = np.random.default_rng()
+
+    choose_b = rng.random(len(a_index)) < 0.5 # prob of gene cross
+    choose_b &= ~static_mask
+
+    if len(B) == 0: # nothing to cross with
+        choose_b[:] = False
+        closest = np.full(len(a_index), -1, dtype=np.int64)
+    elif _cross_nodes_kernel is not None:
+        closest = np.empty(len(a_index), dtype=np.int64)
+        _cross_nodes_kernel(A, B, choose_b, closest)
+    else:
+        # squared pairwise distances: |a|^2 + |b|^2 - 2 a.b
+        d2 = (A * A).sum(1)[:, None] + (B * B).sum(1)[None, :] - 2.0 * A @ B.T
+        closest = d2.argmin(axis=1)
+
+    out = A.copy()
+    out[choose_b] = B[closest[choose_b]]
+
+    return NodeView(a_index, out)
 
 def constant_horizontal_velocity(body, gravity, damping, dt):
     """Custom velocity function to maintain constant horizontal speed"""
@@ -145,60 +258,146 @@ def constant_horizontal_velocity(body, gravity, damping, dt):
     pymunk.Body.update_velocity(body, gravity, damping, dt)
     body.velocity = (target_horizontal_velocity, body.velocity.y)
 
-def comp_max_tension(bridge, start_pos, end_x, screen=None, draw_options=None, clock=None):
-    tps = 60
-    dt = 1 / tps
+def place_ball(bridge, start_pos):
+    """Reset the bridge's ball to start_pos, creating it in the bridge's space if the space came without one"""
+    body = bridge.ball_body
+
+    if body is None:
+        body = pymunk.Body(mass=10, moment=10)
+        body.velocity_func = constant_horizontal_velocity
+        shape = pymunk.Circle(body, 20)
+        shape.filter = ball
+        bridge.space.add(body, shape)
+        bridge.ball_body = body
 
-    body = pymunk.Body(mass=10, moment=10)
     body.position = start_pos
-    body.velocity_func = constant_horizontal_velocity
-    shape = pymunk.Circle(body, 20)
-    shape.filter = ball
-    bridge.space.add(body, shape)
+    body.velocity = (0, 0)
+    body.angle = 0
+    body.angular_velocity = 0
+    bridge.space.reindex_shapes_for_body(body)
+
+    return body
+
+_node_marker = None
+
+def draw_bridge(screen, bridge):
+    global _node_marker
 
-    max_tension = 0
+    if _node_marker is None:
+        _node_marker = pygame.Surface((12, 12), pygame.SRCALPHA)
+        pygame.draw.circle(_node_marker, (0, 0, 0), (6, 6), 6)
+
+    markers = []
+    for segment in bridge.shapes:
+        body = segment.body
+        px, py = body.position
+        angle = body.angle
+        c = math.cos(angle)
+        s = math.sin(angle)
+
+        ax, ay = segment.a
+        bx, by = segment.b
+        p1 = (px + ax * c - ay * s, py + ax * s + ay * c)
+        p2 = (px + bx * c - by * s, py + bx * s + by * c)
+
+        color = (90, 90, 90) if segment.filter.categories == CATEGORY_1 else (160, 110, 60)
+        pygame.draw.line(screen, color, p1, p2, 10)
+
+        markers.append((_node_marker, (p1[0] - 6, p1[1] - 6)))
+        markers.append((_node_marker, (p2[0] - 6, p2[1] - 6)))
+
+    screen.blits(markers, doreturn=False)
+
+TPS = 60 # physics steps per simulated second
+_get_impulse = attrgetter('impulse')
+
+def _sample_max_impulse(joints, max_impulse):
+    """Larger of max_impulse and the largest joint impulse of the current step"""
+    step_max = max(map(_get_impulse, joints), default=0)
+    return step_max if step_max > max_impulse else max_impulse
+
+def _max_tension_headless(bridge, start_pos, end_x, sample_every=4):
+    dt = 1 / TPS
+
+    body = place_ball(bridge, start_pos)
+    step = bridge.space.step
+    joints = tuple(bridge.joints)
+
+    max_impulse = 0
+    step_idx = 0
 
     while body.position.x <= end_x:
-        bridge.space.step(dt)
+        step(dt)
 
-        for joint in bridge.joints:
-            tension = joint.impulse * tps
-            max_tension = max(max_tension, tension)
+        if step_idx % sample_every == 0:
+            max_impulse = _sample_max_impulse(joints, max_impulse)
+        step_idx += 1
 
-        if screen is None or draw_options is None:
-            continue
+    return max_impulse * TPS
+
+def _max_tension_with_render(bridge, start_pos, end_x, screen, clock=None, sample_every=4):
+    dt = 1 / TPS
+
+    body = place_ball(bridge, start_pos)
+    step = bridge.space.step
+    joints = tuple(bridge.joints)
+
+    max_impulse = 0
+    step_idx = 0
+
+    while body.position.x <= end_x:
+        step(dt)
+
+        if step_idx % sample_every == 0:
+            max_impulse = _sample_max_impulse(joints, max_impulse)
+        step_idx += 1
 
         screen.fill("white")
-        bridge.space.debug_draw(draw_options)
+        draw_bridge(screen, bridge)
+        pygame.draw.circle(screen, (200, 40, 40), body.position, 20)
         pygame.display.update()
 
         if clock is None:
             continue
 
-        clock.tick(tps)
+        clock.tick(TPS)
+
+    return max_impulse * TPS
 
-    return max_tension
+def comp_max_tension(bridge, start_pos, end_x, screen=None, *, clock=None, sample_every=4):
+    if screen is None:
+        return _max_tension_headless(bridge, start_pos, end_x, sample_every)
+    return _max_tension_with_render(bridge, start_pos, end_x, screen, clock, sample_every)
 
-def main():
-    pygame.init()
+def comp_max_tension_headless(spec):
+    """spec: (nodes, static_nodes, edges, start_pos, end_x) - rebuilds the bridge in the worker"""
+    nodes, static_nodes, edges, start_pos, end_x = spec
+    with Bridge(nodes, static_nodes, edges) as bridge:
+        return _max_tension_headless(bridge, start_pos, end_x)
 
-    width, height = 600, 400
-    screen = pygame.display.set_mode((width, height))
-    pygame.display.set_caption("Pymunk Bridge Graph with Pygame")
+def main(headless=False):
+    screen = None
+    clock = None
 
-    draw_options = pymunk.pygame_util.DrawOptions(screen)
-    clock = pygame.time.Clock()
+    if not headless:
+        pygame.init()
 
-    random.seed(time.time())
+        width, height = 600, 400
+        screen = pygame.display.set_mode((width, height))
+        pygame.display.set_caption("Pymunk Bridge Graph with Pygame")
+
+        clock = pygame.time.Clock()
+
+    rng = np.random.default_rng(time.time_ns())
 
     a_nodes = {
-        1: pymunk.Vec2d(100, 200),
-        2: pymunk.Vec2d(200, 200),
-        3: pymunk.Vec2d(300, 200),
-        4: pymunk.Vec2d(400, 200),
-        5: pymunk.Vec2d(150, 100),
-        6: pymunk.Vec2d(250, 100),
-        7: pymunk.Vec2d(350, 100),   
+        1: (100, 200),
+        2: (200, 200),
+        3: (300, 200),
+        4: (400, 200),
+        5: (150, 100),
+        6: (250, 100),
+        7: (350, 100),   
     }
 
     a_static_nodes = {1, 7}
@@ -220,12 +419,12 @@ def main():
     }
 
     b_nodes = {
-        1: pymunk.Vec2d(100, 200),
-        2: pymunk.Vec2d(220, 200),
-        3: pymunk.Vec2d(290, 200),
-        4: pymunk.Vec2d(410, 200),
-        5: pymunk.Vec2d(490, 200),
-        6: pymunk.Vec2d(600, 200),
+        1: (100, 200),
+        2: (220, 200),
+        3: (290, 200),
+        4: (410, 200),
+        5: (490, 200),
+        6: (600, 200),
     }
 
     b_static_nodes = {1, 6}
@@ -239,33 +438,41 @@ def main():
     }
 
     population = [
-        Bridge(a_nodes, a_static_nodes, a_edges),
-        Bridge(b_nodes, b_static_nodes, b_edges),
-    ]
-
-    tens = [] # tension, bridge from population
+        (a_nodes, a_static_nodes, a_edges),
+        (b_nodes, b_static_nodes, b_edges),
+    ] # (nodes, static_nodes, edges), bridges are only built to be simulated
 
-    for gen in range(1, 1 + 100):
-        for bridge in population:
-            #tens.append((comp_max_tension(bridge, (100, 180), 600, screen, draw_options, clock), bridge))
-            tens.append((comp_max_tension(bridge, (100, 180), 600, screen, draw_options, None), bridge))
+    tens = [] # tension, spec from population
 
-        tens.sort(key=lambda pair: pair[0])
-
-        max_pop_size = 5
-        if len(tens) > max_pop_size:
-            tens = tens[:max_pop_size]
+    with ProcessPoolExecutor() if headless else nullcontext() as executor:
+        for gen in range(1, 1 + 100):
+            if headless:
+                specs = [(*spec, (100, 180), 600) for spec in population]
+                tens.extend(zip(executor.map(comp_max_tension_headless, specs), population))
+            else:
+                for spec in population:
+                    with Bridge(*spec) as bridge:
+                        #tens.append((_max_tension_with_render(bridge, (100, 180), 600, screen, clock), spec))
+                        tens.append((_max_tension_with_render(bridge, (100, 180), 600, screen, None), spec))
+
+            max_pop_size = 5
+            if len(tens) > max_pop_size:
+                scores = np.fromiter((t for t, _ in tens), np.float64, len(tens))
+                keep = np.argpartition(scores, max_pop_size)[:max_pop_size]
+                tens = [tens[i] for i in sorted(keep.tolist(), key=lambda i: scores[i])]
+            else:
+                tens.sort(key=lambda pair: pair[0])
 
-        population = []
-        for i in range(len(tens)):
-            for j in range(i + 1, len(tens)):
-                a_bridge = tens[i][1]
-                b_bridge = tens[j][1]
-                population.append(Bridge(cross_nodes(a_bridge.nodes, b_bridge.nodes, a_bridge.static_nodes), a_bridge.static_nodes, a_bridge.edges))
+            population = []
+            for i in range(len(tens)):
+                for j in range(i + 1, len(tens)):
+                    a_nodes, a_static_nodes, a_edges = tens[i][1]
+                    b_nodes = tens[j][1][0]
+                    population.append((cross_nodes(a_nodes, b_nodes, a_static_nodes, rng=rng), a_static_nodes, a_edges))
 
-        print(f'[{gen}]\tmin_tens: {tens[0][0]}')
+            print(f'[{gen}]\tmin_tens: {tens[0][0]}')
 
     pygame.quit()
 
 if __name__ == "__main__":
-    main()
+    main(headless='--headless' in sys.argv)
@@ -0,0 +1,138 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import test
+from test import Bridge, comp_max_tension, cross_nodes
+
+
+NODES = {
+    1: (100, 200),
+    2: (200, 200),
+    3: (300, 200),
+    4: (400, 200),
+    5: (150, 100),
+    6: (250, 100),
+    7: (350, 100),
+}
+
+STATIC_NODES = {1, 7}
+
+EDGES = {
+    (1, 2): (10, True),
+    (2, 3): (10, True),
+    (3, 4): (10, True),
+    (1, 5): (10, False),
+    (2, 5): (10, False),
+    (2, 6): (10, False),
+    (3, 6): (10, False),
+    (3, 7): (10, False),
+    (4, 7): (10, False),
+    (5, 6): (10, False),
+    (6, 7): (10, False),
+}
+
+
+class TestCompMaxTension(unittest.TestCase):
+    def test_repeated_calls_on_temporary_bridges(self):
+        for _ in range(3):
+            tension = comp_max_tension(Bridge(NODES, STATIC_NODES, EDGES), (100, 180), 600)
+            self.assertGreater(tension, 0)
+
+    def test_repeated_calls_on_same_bridge(self):
+        bridge = Bridge(NODES, STATIC_NODES, EDGES)
+        for _ in range(2):
+            self.assertGreater(comp_max_tension(bridge, (100, 180), 600), 0)
+
+
+class TestSpacePool(unittest.TestCase):
+    def setUp(self):
+        saved = test._space_pool[:]
+        test._space_pool.clear()
+        self.addCleanup(test._space_pool.__setitem__, slice(None), saved)
+
+    def test_hashed_space_is_not_pooled(self):
+        nodes = {i: (100 + 10 * i, 200) for i in range(40)}
+        edges = {(i, i + 1): (10, True) for i in range(39)}
+
+        bridge = Bridge(nodes, {0, 39}, edges)
+        self.assertTrue(bridge.spatial_hash)
+        space = bridge.space
+        bridge.dispose()
+        self.assertEqual(test._space_pool, [])
+
+    def test_plain_space_is_pooled(self):
+        bridge = Bridge(NODES, STATIC_NODES, EDGES)
+        space = bridge.space
+        bridge.dispose()
+        self.assertEqual(test._space_pool, [(space, None)])
+
+    def test_ball_is_reused_with_pooled_space(self):
+        with Bridge(NODES, STATIC_NODES, EDGES) as bridge:
+            first = comp_max_tension(bridge, (100, 180), 600)
+            ball_body = bridge.ball_body
+
+        with Bridge(NODES, STATIC_NODES, EDGES) as bridge:
+            self.assertIs(bridge.ball_body, ball_body)
+            self.assertIn(ball_body, bridge.space.bodies)
+            self.assertAlmostEqual(comp_max_tension(bridge, (100, 180), 600), first)
+
+    def test_dispose_twice(self):
+        bridge = Bridge(NODES, STATIC_NODES, EDGES)
+        bridge.dispose()
+        bridge.dispose()
+        self.assertIsNone(bridge.space)
+
+
+class TestCrossNodes(unittest.TestCase):
+    def test_static_nodes_are_kept(self):
+        child = cross_nodes(NODES, {1: (0, 0), 2: (1000, 1000)}, NODES.keys())
+        self.assertEqual(dict(child), {n: (float(x), float(y)) for n, (x, y) in NODES.items()})
+
+    def test_empty_b_nodes(self):
+        child = cross_nodes(NODES, {}, STATIC_NODES)
+        self.assertEqual(dict(child), {n: (float(x), float(y)) for n, (x, y) in NODES.items()})
+
+    def test_child_shares_parent_index(self):
+        parent = cross_nodes(NODES, NODES, STATIC_NODES)
+        child = cross_nodes(parent, NODES, STATIC_NODES)
+        self.assertIs(child.index, parent.index)
+        self.assertIsNot(child.pos, parent.pos)
+
+    def test_numpy_path_picks_nearest_b(self):
+        rng = np.random.default_rng(0)
+        a_nodes = {n: tuple(p) for n, p in enumerate(rng.random((50, 2)) * 600)}
+        b_nodes = {n: tuple(p) for n, p in enumerate(rng.random((30, 2)) * 600)}
+        static_nodes = {0, 1, 2}
+
+        with mock.patch.object(test, "_cross_nodes_kernel", None):
+            child = cross_nodes(a_nodes, b_nodes, static_nodes, rng=np.random.default_rng(1))
+
+        # same draws as cross_nodes made
+        crossed = np.random.default_rng(1).random(len(a_nodes)) < 0.5
+        B = np.array(list(b_nodes.values()))
+        for n, a_pos in a_nodes.items():
+            if crossed[n] and n not in static_nodes:
+                nearest = B[((B - a_pos) ** 2).sum(1).argmin()]
+                self.assertEqual(child[n], tuple(nearest))
+            else:
+                self.assertEqual(child[n], a_pos)
+
+    @unittest.skipIf(test._cross_nodes_kernel is None, "numba not installed")
+    def test_kernel_matches_numpy(self):
+        rng = np.random.default_rng(0)
+        A = rng.random((50, 2)) * 600
+        B = rng.random((30, 2)) * 600
+        choose_b = rng.random(50) < 0.5
+
+        out = np.empty(50, dtype=np.int64)
+        test._cross_nodes_kernel(A, B, choose_b, out)
+
+        d2 = ((A[:, None, :] - B[None, :, :]) ** 2).sum(-1)
+        np.testing.assert_array_equal(out[choose_b], d2.argmin(axis=1)[choose_b])
+        self.assertTrue((out[~choose_b] == -1).all())
+
+
+if __name__ == "__main__":
+    unittest.main()